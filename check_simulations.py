@@ -0,0 +1,94 @@
+# Checks that the different implementations of the monthly simulation agree:
+# PortfolioManager.simulate_month (plain python), PortfolioManager.simulate_year
+# (compiled kernel) and BatchPortfolioManager (all scenarios at once). Run after
+# changing any of them:
+#
+#   python check_simulations.py
+#
+# Rounding to cents differs slightly between python's round and numpy / numba
+# (on exact half cents), which adds up to a few cents over a whole simulation.
+import numpy as np
+
+from classes import (
+    BatchPortfolioManager,
+    GenerosityStrategy,
+    PortfolioManager,
+    Salary,
+    SpendingStrategy,
+)
+
+tolerance = 0.5  # dollars
+
+# person_age, salary, disp_give, straight_percent, investment_draw_down_rate
+scenarios = {
+    "default": (28, 112000, 0.1, 0.5, 0.04),
+    "many assets": (28, 1500000, 0.05, 0.9, 0.01),
+    "retiree": (60, 250000, 0.1, 0.3, 0.02),
+    "low salary": (28, 30000, 0.3, 0.1, 0.03),
+}
+years = 40
+retirement_savings = 39396
+giving_savings = 4150
+
+
+def _strategies(disp_give, straight_percent, investment_draw_down_rate):
+    spendstrat = SpendingStrategy(0.5, 0.15, 0.15, disp_give)
+    genstrat = GenerosityStrategy(straight_percent, investment_draw_down_rate, 0.2)
+    return spendstrat, genstrat
+
+
+def _portfolio_manager(person_age, salary, *strategy):
+    pm = PortfolioManager(person_age, *_strategies(*strategy), Salary(salary))
+    pm.init_retirement_savings(retirement_savings)
+    pm.init_giving_savings(giving_savings)
+    return pm
+
+
+def _batch_portfolio_manager(person_age, scenarios):
+    spendstrats, genstrats = zip(*[_strategies(*s[2:]) for s in scenarios])
+    pm = BatchPortfolioManager(
+        person_age, spendstrats, genstrats, [s[1] for s in scenarios]
+    )
+    pm.init_retirement_savings(retirement_savings)
+    pm.init_giving_savings(giving_savings)
+    return pm
+
+
+def _compare(name, path, expected, actual):
+    if expected["Number Assets"].tolist() != actual["Number Assets"].tolist():
+        raise AssertionError(f"{name}: {path} bought assets in different years")
+    diff = np.abs(expected.to_numpy() - actual.to_numpy()).max(axis=0)
+    if diff.max() > tolerance:
+        column = expected.columns[diff.argmax()]
+        raise AssertionError(f"{name}: {path} is off by {diff.max():.2f} in {column!r}")
+    return diff.max()
+
+
+def check_simulations():
+    frames = {}
+    for name, scenario in scenarios.items():
+        by_month = _portfolio_manager(*scenario)
+        for i in range(12 * years):
+            by_month.simulate_month((i + 1) / 12)
+        by_year = _portfolio_manager(*scenario)
+        for year in range(years):
+            by_year.simulate_year(year)
+        frames[name] = by_month.df
+        diff = _compare(name, "simulate_year", by_month.df, by_year.df)
+        print(f"{name}: simulate_year within {diff:.2f}")
+
+    # the batch has a single person_age, so group the scenarios by age
+    for person_age in sorted({s[0] for s in scenarios.values()}):
+        names = [name for name, s in scenarios.items() if s[0] == person_age]
+        batch = _batch_portfolio_manager(person_age, [scenarios[n] for n in names])
+        for i in range(12 * years):
+            batch.simulate_month((i + 1) / 12)
+        df = batch.df
+        for i, name in enumerate(names):
+            actual = df[df["scenario"] == i].drop(columns="scenario")
+            diff = _compare(name, "BatchPortfolioManager", frames[name], actual)
+            print(f"{name}: BatchPortfolioManager within {diff:.2f}")
+
+
+if __name__ == "__main__":
+    check_simulations()
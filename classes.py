@@ -1,6 +1,27 @@
+import warnings
+
+import numpy as np
 import pandas as pd
 from datetime import date
 
+import kernel
+
+try:
+    # ahead-of-time compiled kernel, built by compile_kernel.py
+    import gen_kernel
+except ImportError:
+    _simulate_year = kernel.simulate_year
+else:
+    # a build from another kernel.py has different layouts and no bounds checks
+    if getattr(gen_kernel, "kernel_hash", lambda: None)() == kernel.source_hash():
+        _simulate_year = gen_kernel.simulate_year
+    else:
+        warnings.warn(
+            "gen_kernel was built from a different kernel.py, using the JIT kernel "
+            "instead (rebuild with python compile_kernel.py)"
+        )
+        _simulate_year = kernel.simulate_year
+
 
 class Person:
     def __init__(self, age, income, spending_strategy, generosity_strategy):
@@ -17,56 +38,87 @@ class Person:
 
 
 class PortfolioManager:
+    columns = [
+        "years_from_start",
+        "Age",
+        "Salary",
+        "Total Income",
+        "Total Taxes",
+        "Post Tax Income",
+        "Retirement Savings",
+        "Giving Savings",
+        "Asset Savings",
+        "Total Giving",
+        "Number Assets",
+    ]
+    retirement_age = 65
+    retirement_draw_down_rate = 0.07  # annual
+    # 3.8% = avg appreciation US / year, 1% of total value is average rent
+    asset_price = 150000  # in start-of-simulation dollars
+    asset_growth_rate = 0.038
+    asset_dividend_rate = 0.01
+    salary_raise = 1.05  # annual
+    _initial_asset_capacity = 16
+
     def __init__(
         self,
         person_age,
         spendstrat,
         genstrat,
         salary,
+        track_history=True,
     ):
         self.person_age = person_age
         self.spendstrat = spendstrat
         self.genstrat = genstrat
         self.salary = salary
+        # without history only the current state and giving totals are kept
+        self._track = track_history
+        self._income_coeffs = _income_coefficients(spendstrat, genstrat)
         self.ia = InflationAdjuster(0.04)
         self.tax_cal = TaxCalculator()
-        self.taxes_ytd_ia = {}
-        self.income_ytd_ia = {}
-        self.giving_ytd_ia = {}
+        # indexed by month (1-12), index 0 is unused
+        self.taxes_ytd_ia = np.zeros(13)
+        self.income_ytd_ia = np.zeros(13)
+        self.giving_ytd_ia = np.zeros(13)
+        self.giving_to_date_ia = 0
         # NOTE: a 0.096 growth rate (compounded monthly) is equivalent to 10% growth rate (compounded annually)
-        self.retirement_investment = Investment("Retirement", 0.096, tax_free=True)
-        self.giving_investment = Investment("Giving", 0.096)
-        self.assets = []
-        self.asset_savings = Investment("Asset Savings", 0.096)
-        self.df = pd.DataFrame(
-            {
-                "years_from_start": [0],
-                "Age": [person_age],
-                "Salary": [0],
-                "Total Income": [0],
-                "Total Taxes": [0],
-                "Post Tax Income": [0],
-                "Retirement Savings": [0],
-                "Giving Savings": [0],
-                "Asset Savings": [0],
-                "Total Giving": [0],
-                "Number Assets": [0],
-            }
+        self.retirement_investment = Investment(
+            "Retirement", 0.096, tax_free=True, track_history=track_history
         )
+        self.giving_investment = Investment(
+            "Giving", 0.096, track_history=track_history
+        )
+        # owned assets, the first n_assets entries of each array are in use (the
+        # arrays are grown as needed)
+        self._n_assets = 0
+        self._asset_values = np.zeros(self._initial_asset_capacity)
+        self._asset_div_rates = np.zeros(self._initial_asset_capacity)  # monthly
+        self._asset_growth = np.zeros(self._initial_asset_capacity)  # annual
+        self._asset_last_growth = np.zeros(self._initial_asset_capacity)
+        # monthly profit of all assets, only changes when assets are bought or grow
+        self._assets_income = 0
+        self.asset_savings = Investment(
+            "Asset Savings", 0.096, track_history=track_history
+        )
+        # one row per simulated year, only turned into a DataFrame on demand
+        self._rows = [[0, person_age, 0, 0, 0, 0, 0, 0, 0, 0, 0]]
 
     def _get_paid(self, years_from_start: float):
         salary_paycheck = 0
         assets_income = 0
         retirement_income = 0
-        if self.person_age + years_from_start >= 65:
-            retirement_withdrawal = self.retirement_investment.total * (0.07 / 12)
+        if self.person_age + years_from_start >= self.retirement_age:
+            retirement_withdrawal = self.retirement_investment.total * (
+                self.retirement_draw_down_rate / 12
+            )
             self.retirement_investment.withdraw_accounting_for_taxes(
                 retirement_withdrawal, years_from_start
             )
             retirement_income = retirement_withdrawal
         else:
             salary_paycheck = round(self.salary.get_paid(), 2)
-        assets_income = sum([asset.pay_dividend() for asset in self.assets])
+        assets_income = self._assets_income
         # if past 65 start drawing down 7% / year retirement savings
 
         total_income = salary_paycheck + assets_income + retirement_income
@@ -85,7 +137,7 @@ class PortfolioManager:
 
         # if 12th month of year, get tax return
         if current_month == 12:
-            tax_return = self._get_tax_return()
+            tax_return = self._get_tax_return(tax_rate)
             total_income += tax_return
             self.taxes_ytd_ia[current_month] -= tax_return
 
@@ -122,7 +174,7 @@ class PortfolioManager:
 
         # -----------determine n assets to purchase-----------
         n_assets = 0
-        asset_price = self.ia.forward_adjust(150000, years_from_start)
+        asset_price = self.ia.forward_adjust(self.asset_price, years_from_start)
         if disp_invest >= asset_price:
             n_assets = int(disp_invest / asset_price)
             disp_invest -= n_assets * asset_price
@@ -139,18 +191,16 @@ class PortfolioManager:
             )
 
     def _purchase_assets(self, n_assets, asset_price, disp_invest, years_from_start):
+        if self._n_assets + n_assets > self._asset_values.size:
+            self._grow_asset_buffers(self._n_assets + n_assets)
+        new = slice(self._n_assets, self._n_assets + n_assets)
+        self._asset_values[new] = asset_price
+        self._asset_div_rates[new] = Asset.profit_rate(self.asset_dividend_rate)
+        self._asset_growth[new] = self.asset_growth_rate
+        self._asset_last_growth[new] = years_from_start
+        self._n_assets += n_assets
+        self._update_assets_income()
         for i in range(n_assets):
-            current_assets = len(self.assets)
-            new_asset_name = f"Asset {current_assets+i}+1"
-            # 3.8% = avg appreciation US / year, 1% of total value is average rent
-            new_asset = Asset(
-                name=new_asset_name,
-                value=asset_price,
-                growth_rate=0.038,
-                dividend_rate=0.01,
-                years_from_start=years_from_start,
-            )
-            self.assets.append(new_asset)
             if disp_invest >= asset_price:
                 disp_invest -= asset_price
             else:
@@ -164,29 +214,59 @@ class PortfolioManager:
         self.giving_investment.grow(years_from_start)
         self.asset_savings.grow(years_from_start)
         # only update assets once / year (to replicate rent not rising every month)
-        if current_month == 12:
-            for asset in self.assets:
-                # have to now account for the whole year
-                asset.grow(years_from_start)
-
-    def _get_tax_return(self):
-        sum_taxes = sum(self.taxes_ytd_ia.values())
-        return self.tax_cal.get_tax_return(sum_taxes)
+        if current_month == 12 and self._n_assets:
+            # have to now account for the whole year
+            n = self._n_assets
+            values = self._asset_values[:n]
+            last_growth = self._asset_last_growth[:n]
+            grow = years_from_start >= (last_growth + 1)
+            values[grow] = np.round(
+                values[grow] * (1 + self._asset_growth[:n][grow]), 2
+            )
+            last_growth[grow] = years_from_start
+            self._update_assets_income()
+
+    def _update_assets_income(self):
+        n = self._n_assets
+        self._assets_income = np.round(
+            self._asset_div_rates[:n] * self._asset_values[:n], 2
+        ).sum()
+
+    def _grow_asset_buffers(self, needed):
+        capacity = max(2 * self._asset_values.size, needed)
+        for attr in [
+            "_asset_values",
+            "_asset_div_rates",
+            "_asset_growth",
+            "_asset_last_growth",
+        ]:
+            old = getattr(self, attr)
+            new = np.zeros(capacity)
+            new[: old.size] = old
+            setattr(self, attr, new)
+
+    @property
+    def n_assets(self):
+        return self._n_assets
+
+    def _get_tax_return(self, tax_rate):
+        sum_taxes = self.taxes_ytd_ia.sum()
+        return self.tax_cal.get_tax_return(sum_taxes, tax_rate)
 
     def _close_out_year(self):
         self.tax_cal.reset_year()
-        self.taxes_ytd_ia = {}
-        self.salary.get_raise(1.05)
-        self.income_ytd_ia = {}
-        self.giving_ytd_ia = {}
+        self.taxes_ytd_ia.fill(0.0)
+        self.salary.get_raise(self.salary_raise)
+        self.income_ytd_ia.fill(0.0)
+        self.giving_ytd_ia.fill(0.0)
 
     def init_retirement_savings(self, amount):
         self.retirement_investment.add(amount, 0)
-        self.df.iloc[0, self.df.columns.get_loc("Retirement Savings")] = amount
+        self._rows[0][self.columns.index("Retirement Savings")] = amount
 
     def init_giving_savings(self, amount):
         self.giving_investment.add(amount, 0)
-        self.df.iloc[0, self.df.columns.get_loc("Giving Savings")] = amount
+        self._rows[0][self.columns.index("Giving Savings")] = amount
 
     def simulate_month(self, years_from_start):
         fraction = years_from_start % 1
@@ -204,38 +284,500 @@ class PortfolioManager:
             self._update_df(years_from_start)
             self._close_out_year()
 
+    def simulate_year(self, year):
+        # runs the 12 months after `year` whole years in the compiled kernel, same as
+        # calling simulate_month for each month except that the investments don't
+        # record their monthly history (and rounding to cents can differ by a cent)
+        if self.income_ytd_ia.any() or self.tax_cal.year_to_date.any():
+            # the kernel always runs months 1-12 from empty year to date values
+            raise ValueError(
+                "simulate_year has to start at the beginning of a year, finish the "
+                "current year with simulate_month first"
+            )
+        state, params, assets, ytd = self._pack_state()
+        assets = _simulate_year(
+            state,
+            params,
+            assets,
+            ytd,
+            _UPPERS,
+            _RATES,
+            self.ia.reverse_factors,
+            self.ia.forward_factors,
+            year,
+        )
+        self._unpack_state(state, assets, ytd, year + 1)
+        self._update_df(year + 1)
+        self._close_out_year()
+
+    def _pack_state(self):
+        state, params = _kernel_rows(
+            self,
+            self.salary.salary,
+            self._income_coeffs,
+            self.genstrat.investment_draw_down_rate,
+        )
+        # the kernel only uses the first n_assets columns, the rest is spare capacity
+        assets = np.empty((kernel.ASSET_ROWS, self._asset_values.size))
+        assets[kernel.ASSET_VALUE] = self._asset_values
+        assets[kernel.ASSET_PROFIT_RATE] = self._asset_div_rates
+        assets[kernel.ASSET_GROWTH_RATE] = self._asset_growth
+        assets[kernel.ASSET_LAST_GROWTH] = self._asset_last_growth
+        ytd = np.zeros((kernel.YTD_ROWS, 13))
+        return state, params, assets, ytd
+
+    def _unpack_state(self, state, assets, ytd, years_from_start):
+        for inv, investment in _kernel_investments(self):
+            investment.restore(
+                state[inv],
+                state[inv + 1],
+                None if state[inv + 2] < 0 else state[inv + 2],
+                years_from_start,
+            )
+
+        self._n_assets = int(state[kernel.N_ASSETS])
+        self._asset_values = assets[kernel.ASSET_VALUE].copy()
+        self._asset_div_rates = assets[kernel.ASSET_PROFIT_RATE].copy()
+        self._asset_growth = assets[kernel.ASSET_GROWTH_RATE].copy()
+        self._asset_last_growth = assets[kernel.ASSET_LAST_GROWTH].copy()
+        self._update_assets_income()
+
+        self.tax_cal.year_to_date[:] = ytd[kernel.YTD_INCOME]
+        self.tax_cal.projected_inflation_adjusted_income[:] = ytd[
+            kernel.YTD_PROJECTED_INCOME
+        ]
+        self.income_ytd_ia[:] = ytd[kernel.YTD_INCOME]
+        self.taxes_ytd_ia[:] = ytd[kernel.YTD_TAXES]
+        self.giving_ytd_ia[:] = ytd[kernel.YTD_GIVING]
+
+    def total_giving(self, years_from_start, include_legacy=True):
+        # inflation adjusted giving so far plus what is left to give away
+        total = self.giving_to_date_ia + self.ia.reverse_adjust(
+            self.giving_investment.total, years_from_start
+        )
+        if include_legacy:
+            total += self.ia.reverse_adjust(
+                self.retirement_investment.total * self.genstrat.legacy_give_percent,
+                years_from_start,
+            )
+        return total
+
     def _update_df(self, years_from_start):
-        new_row = pd.DataFrame(
-            {
-                "years_from_start": [years_from_start],
-                "Age": [self.person_age + years_from_start],
-                "Salary": [
-                    self.ia.reverse_adjust(self.salary.salary, years_from_start)
-                ],
-                "Total Income": [sum(self.income_ytd_ia.values())],
-                "Total Taxes": [sum(self.taxes_ytd_ia.values())],
-                "Post Tax Income": [
-                    sum(self.income_ytd_ia.values()) - sum(self.taxes_ytd_ia.values())
-                ],
-                "Retirement Savings": [
+        total_giving = self.giving_ytd_ia.sum()
+        self.giving_to_date_ia += total_giving
+        if not self._track:
+            return
+        total_income = self.income_ytd_ia.sum()
+        total_taxes = self.taxes_ytd_ia.sum()
+        self._rows.append(
+            [
+                years_from_start,
+                self.person_age + years_from_start,
+                self.ia.reverse_adjust(self.salary.salary, years_from_start),
+                total_income,
+                total_taxes,
+                total_income - total_taxes,
+                self.ia.reverse_adjust(
+                    self.retirement_investment.total, years_from_start
+                ),
+                self.ia.reverse_adjust(self.giving_investment.total, years_from_start),
+                self.ia.reverse_adjust(self.asset_savings.total, years_from_start),
+                total_giving,
+                self.n_assets,
+            ]
+        )
+
+    def to_frame(self):
+        return pd.DataFrame(self._rows, columns=self.columns).round(2)
+
+    @property
+    def df(self):
+        return self.to_frame()
+
+
+class BatchPortfolioManager:
+    # same simulation as PortfolioManager, but for many scenarios at once: every
+    # per-scenario value is an array with one entry per scenario
+    columns = ["scenario"] + PortfolioManager.columns
+    retirement_age = PortfolioManager.retirement_age
+    retirement_draw_down_rate = PortfolioManager.retirement_draw_down_rate
+    asset_price = PortfolioManager.asset_price
+    asset_growth_rate = PortfolioManager.asset_growth_rate
+    asset_dividend_rate = PortfolioManager.asset_dividend_rate
+    salary_raise = PortfolioManager.salary_raise
+
+    def __init__(
+        self,
+        person_age,
+        spendstrats,
+        genstrats,
+        salaries,
+        track_history=True,
+        dtype=np.float64,
+    ):
+        self.person_age = person_age
+        self._track = track_history
+        self.n_scenarios = len(spendstrats)
+        n = self.n_scenarios
+        # dtype of the per-scenario state, np.float32 halves the memory traffic of
+        # big sweeps at the cost of ~7 significant digits (a few dollars on the
+        # larger balances). Giving totals are always accumulated in float64
+        self.dtype = dtype
+        # (6, scenarios) so one multiply splits every scenario's paycheck
+        self._income_coeffs = np.column_stack(
+            [_income_coefficients(s, g) for s, g in zip(spendstrats, genstrats)]
+        ).astype(dtype)
+        self.draw_down_rate = np.array(
+            [g.investment_draw_down_rate for g in genstrats], dtype=dtype
+        )
+        self.legacy_give_percent = np.array(
+            [g.legacy_give_percent for g in genstrats], dtype=dtype
+        )
+        self.salaries = np.array(salaries, dtype=dtype)
+        self.ia = InflationAdjuster(0.04)
+        # month 1-12, 0 unused
+        self.projected_income_ytd_ia = np.zeros((n, 13), dtype=dtype)
+        self.taxes_ytd_ia = np.zeros((n, 13), dtype=dtype)
+        self.income_ytd_ia = np.zeros((n, 13), dtype=dtype)
+        self.giving_ytd_ia = np.zeros((n, 13), dtype=dtype)
+        self.giving_to_date_ia = np.zeros(n)
+        self.retirement_investment = BatchInvestment(
+            "Retirement", 0.096, n, tax_free=True, dtype=dtype
+        )
+        self.giving_investment = BatchInvestment("Giving", 0.096, n, dtype=dtype)
+        self.asset_savings = BatchInvestment("Asset Savings", 0.096, n, dtype=dtype)
+        # one column per owned asset, unused slots are worth 0 and never grow
+        self.n_assets = np.zeros(n, dtype=int)
+        self.asset_values = np.zeros((n, 4), dtype=dtype)
+        # kept in float64, float32 years_from_start would be off by a fraction of
+        # a second and skip some of the yearly asset growth
+        self.asset_last_growth = np.full((n, 4), np.inf)
+        self.asset_profit_rate = np.dtype(dtype).type(
+            Asset.profit_rate(self.asset_dividend_rate)
+        )
+        first_row = np.zeros((n, len(self.columns)))
+        first_row[:, 0] = np.arange(n)
+        first_row[:, self.columns.index("Age")] = person_age
+        self._rows = [first_row]
+
+    def _get_paid(self, years_from_start: float):
+        salary_paycheck = np.zeros(self.n_scenarios, dtype=self.dtype)
+        retirement_income = np.zeros(self.n_scenarios, dtype=self.dtype)
+        if self.person_age + years_from_start >= self.retirement_age:
+            retirement_income = self.retirement_investment.total * (
+                self.retirement_draw_down_rate / 12
+            )
+            self.retirement_investment.withdraw_accounting_for_taxes(retirement_income)
+        else:
+            salary_paycheck = np.round(self.salaries / 12, 2)
+        assets_income = np.round(self.asset_profit_rate * self.asset_values, 2).sum(
+            axis=1
+        )
+
+        total_income = salary_paycheck + assets_income + retirement_income
+        n_years = int(years_from_start)
+        ia_income = np.round(self.ia.reverse_adjust(total_income, n_years), 2)
+        fraction = years_from_start % 1
+        current_month = round(fraction * 12) if fraction != 0 else 12
+
+        self.income_ytd_ia[:, current_month] = ia_income
+        projected_income = self.income_ytd_ia[:, 1 : current_month + 1].sum(axis=1) / (
+            current_month / 12
+        ) - (TaxCalculator.standard_deduction)
+        self.projected_income_ytd_ia[:, current_month] = projected_income
+        tax_rate = _bracket_rate(projected_income).astype(self.dtype)
+        self.taxes_ytd_ia[:, current_month] = ia_income * tax_rate
+
+        # if 12th month of year, get tax return
+        if current_month == 12:
+            tax_return = self._get_tax_return(tax_rate)
+            total_income += tax_return
+            self.taxes_ytd_ia[:, current_month] -= tax_return
+
+        return total_income * (1 - tax_rate)
+
+    def _manage_income(self, income, years_from_start):
+        split = income * self._income_coeffs  # see _income_coefficients
+        retirement_saving, disp_invest = split[1], split[3]
+        spend_give, invest_give = split[4], split[5]
+
+        current_month = (
+            round((years_from_start % 1) * 12) if years_from_start % 1 != 0 else 12
+        )
+        # -----------handle giving-----------
+        withdrawal = self.giving_investment.total * self.draw_down_rate
+
+        self.giving_investment.withdraw_accounting_for_taxes(withdrawal)
+        self.giving_investment.add(invest_give)
+
+        spend_give_ia = self.ia.reverse_adjust(spend_give, years_from_start)
+        withdrawal_ia = self.ia.reverse_adjust(withdrawal, years_from_start)
+        self.giving_ytd_ia[:, current_month] = spend_give_ia + withdrawal_ia
+
+        # -----------handle investing-----------
+        self.retirement_investment.add(retirement_saving)
+
+        # -----------determine n assets to purchase-----------
+        asset_price = self.ia.forward_adjust(self.asset_price, years_from_start)
+        n_assets = np.where(
+            disp_invest >= asset_price, np.trunc(disp_invest / asset_price), 0
+        ).astype(int)
+        disp_invest -= n_assets * asset_price
+        n_assets += self.asset_savings.test_sufficient_funds(asset_price - disp_invest)
+
+        self.asset_savings.add(disp_invest, where=n_assets == 0)
+        if n_assets.any():
+            self._purchase_assets(
+                n_assets,
+                round(asset_price, 2),
+                np.round(disp_invest, 2),
+                years_from_start,
+            )
+
+    def _purchase_assets(self, n_assets, asset_price, disp_invest, years_from_start):
+        capacity = self.asset_values.shape[1]
+        needed = (self.n_assets + n_assets).max()
+        if needed > capacity:
+            extra = max(capacity, needed - capacity)
+            self.asset_values = np.pad(self.asset_values, ((0, 0), (0, extra)))
+            self.asset_last_growth = np.pad(
+                self.asset_last_growth, ((0, 0), (0, extra)), constant_values=np.inf
+            )
+        for i in range(n_assets.max()):
+            buying = np.nonzero(i < n_assets)[0]
+            slots = self.n_assets[buying]
+            self.asset_values[buying, slots] = asset_price
+            self.asset_last_growth[buying, slots] = years_from_start
+            self.n_assets[buying] += 1
+
+            from_savings = (i < n_assets) & (disp_invest < asset_price)
+            disp_invest = np.where(
+                (i < n_assets) & ~from_savings, disp_invest - asset_price, disp_invest
+            )
+            # take the remainder from the asset_savings
+            self.asset_savings.withdraw_accounting_for_taxes(
+                np.where(from_savings, np.round(asset_price - disp_invest, 2), 0)
+            )
+
+    def _grow_investments_and_assets(self, years_from_start, current_month):
+        self.retirement_investment.grow()
+        self.giving_investment.grow()
+        self.asset_savings.grow()
+        # only update assets once / year (to replicate rent not rising every month)
+        if current_month == 12:
+            grow = years_from_start >= (self.asset_last_growth + 1)
+            self.asset_values = np.where(
+                grow,
+                np.round(self.asset_values * (1 + self.asset_growth_rate), 2),
+                self.asset_values,
+            )
+            self.asset_last_growth[grow] = years_from_start
+
+    def _get_tax_return(self, tax_rate):
+        sum_taxes = self.taxes_ytd_ia.sum(axis=1)
+        return sum_taxes - self.projected_income_ytd_ia[:, 12] * tax_rate
+
+    def _close_out_year(self):
+        self.projected_income_ytd_ia.fill(0)
+        self.taxes_ytd_ia.fill(0)
+        self.salaries *= self.salary_raise
+        self.income_ytd_ia.fill(0)
+        self.giving_ytd_ia.fill(0)
+
+    def init_retirement_savings(self, amount):
+        amount = np.broadcast_to(
+            np.asarray(amount, dtype=self.dtype), (self.n_scenarios,)
+        )
+        self.retirement_investment.add(amount)
+        self._rows[0][:, self.columns.index("Retirement Savings")] = amount
+
+    def init_giving_savings(self, amount):
+        amount = np.broadcast_to(
+            np.asarray(amount, dtype=self.dtype), (self.n_scenarios,)
+        )
+        self.giving_investment.add(amount)
+        self._rows[0][:, self.columns.index("Giving Savings")] = amount
+
+    def simulate_month(self, years_from_start):
+        fraction = years_from_start % 1
+        current_month = round(fraction * 12) if fraction != 0 else 12
+        income = self._get_paid(years_from_start)
+        self._manage_income(income, years_from_start)
+        self._grow_investments_and_assets(years_from_start, current_month)
+        if current_month == 12:
+            self._update_df(years_from_start)
+            self._close_out_year()
+
+    def simulate_gpu(self, start_year, n_years, max_assets=256):
+        # runs n_years whole years after start_year on the GPU with one thread per
+        # scenario. Only the state at the end comes back, so there are no yearly
+        # rows and the batch has to be created with track_history=False. Each
+        # scenario can own at most max_assets assets
+        import gpu_kernel
+
+        if self._track:
+            raise ValueError(
+                "simulate_gpu doesn't record the yearly history, create the batch "
+                "with track_history=False"
+            )
+        # the device starts every year from empty year to date values
+        ytd = [
+            self.projected_income_ytd_ia,
+            self.taxes_ytd_ia,
+            self.income_ytd_ia,
+            self.giving_ytd_ia,
+        ]
+        if any(values.any() for values in ytd):
+            raise ValueError(
+                "simulate_gpu has to start at the beginning of a year, finish the "
+                "current year with simulate_month first"
+            )
+
+        n = self.n_scenarios
+        max_assets = max(max_assets, self.asset_values.shape[1])
+        state, params = _kernel_rows(
+            self, self.salaries, self._income_coeffs, self.draw_down_rate
+        )
+
+        capacity = self.asset_values.shape[1]
+        assets = np.zeros((n, kernel.ASSET_ROWS, max_assets))
+        assets[:, kernel.ASSET_VALUE, :capacity] = self.asset_values
+        assets[:, kernel.ASSET_PROFIT_RATE] = self.asset_profit_rate
+        assets[:, kernel.ASSET_GROWTH_RATE] = self.asset_growth_rate
+        assets[:, kernel.ASSET_LAST_GROWTH] = np.inf
+        assets[:, kernel.ASSET_LAST_GROWTH, :capacity] = self.asset_last_growth
+
+        gpu_kernel.simulate_years(
+            state,
+            params,
+            assets,
+            self.giving_to_date_ia,
+            _UPPERS,
+            _RATES,
+            self.ia.reverse_factors,
+            self.ia.forward_factors,
+            start_year,
+            n_years,
+            self.salary_raise,
+        )
+
+        # the device runs in float64, cast back to the batch dtype
+        state = state.astype(self.dtype)
+        for inv, investment in _kernel_investments(self):
+            investment.restore(
+                state[:, inv],
+                state[:, inv + 1],
+                np.where(state[:, inv + 2] < 0, np.nan, state[:, inv + 2]),
+            )
+        self.n_assets = state[:, kernel.N_ASSETS].astype(int)
+        self.salaries = params[:, kernel.P_SALARY].astype(self.dtype)
+        # drop the unused slots, simulate_month works on every column
+        width = max(self.n_assets.max(), capacity)
+        self.asset_values = assets[:, kernel.ASSET_VALUE, :width].astype(self.dtype)
+        self.asset_last_growth = assets[:, kernel.ASSET_LAST_GROWTH, :width].copy()
+
+    def total_giving(self, years_from_start, include_legacy=True):
+        # inflation adjusted giving so far plus what is left to give away
+        total = self.giving_to_date_ia + self.ia.reverse_adjust(
+            self.giving_investment.total, years_from_start
+        )
+        if include_legacy:
+            total += self.ia.reverse_adjust(
+                self.retirement_investment.total * self.legacy_give_percent,
+                years_from_start,
+            )
+        return total
+
+    def _update_df(self, years_from_start):
+        total_income = self.income_ytd_ia.sum(axis=1)
+        total_taxes = self.taxes_ytd_ia.sum(axis=1)
+        total_giving = self.giving_ytd_ia.sum(axis=1, dtype=np.float64)
+        self.giving_to_date_ia += total_giving
+        if not self._track:
+            return
+        self._rows.append(
+            np.column_stack(
+                [
+                    np.arange(self.n_scenarios),
+                    np.full(self.n_scenarios, years_from_start),
+                    np.full(self.n_scenarios, self.person_age + years_from_start),
+                    self.ia.reverse_adjust(self.salaries, years_from_start),
+                    total_income,
+                    total_taxes,
+                    total_income - total_taxes,
                     self.ia.reverse_adjust(
                         self.retirement_investment.total, years_from_start
-                    )
-                ],
-                "Giving Savings": [
+                    ),
                     self.ia.reverse_adjust(
                         self.giving_investment.total, years_from_start
-                    )
-                ],
-                "Asset Savings": [
-                    self.ia.reverse_adjust(self.asset_savings.total, years_from_start)
-                ],
-                "Total Giving": [sum(self.giving_ytd_ia.values())],
-                "Number Assets": [len(self.assets)],
-            }
+                    ),
+                    self.ia.reverse_adjust(self.asset_savings.total, years_from_start),
+                    total_giving,
+                    self.n_assets,
+                ]
+            )
+        )
+
+    def to_frame(self):
+        df = pd.DataFrame(np.concatenate(self._rows), columns=self.columns)
+        df = df.astype({"scenario": int, "Number Assets": int})
+        return (
+            df.sort_values(["scenario", "years_from_start"], kind="stable")
+            .reset_index(drop=True)
+            .round(2)
         )
-        self.df = pd.concat([self.df, new_row], ignore_index=True)
-        self.df = self.df.round(2)
+
+    @property
+    def df(self):
+        return self.to_frame()
+
+
+def _kernel_investments(manager):
+    # the investments of a (Batch)PortfolioManager and their slots in kernel.py's state
+    return [
+        (kernel.RETIREMENT, manager.retirement_investment),
+        (kernel.GIVING, manager.giving_investment),
+        (kernel.ASSET_SAVINGS, manager.asset_savings),
+    ]
+
+
+def _kernel_rows(manager, salary, income_coeffs, draw_down_rate):
+    # kernel.py's state and params for a PortfolioManager (scalars) or a
+    # BatchPortfolioManager (one row per scenario). Filled one field at a time
+    # with the scenarios last, which keeps the scalar case cheap
+    shape = getattr(salary, "shape", ())
+    state = np.zeros((kernel.STATE_SIZE,) + shape)
+    for inv, investment in _kernel_investments(manager):
+        state[inv] = investment.nstocks
+        state[inv + 1] = investment.stock_cost
+        # a cost basis that isn't set yet (None / nan) is -1 in the kernel
+        cost_basis = investment.cost_basis
+        if cost_basis is None:
+            cost_basis = -1
+        elif shape:
+            cost_basis = np.where(np.isnan(cost_basis), -1, cost_basis)
+        state[inv + 2] = cost_basis
+    state[kernel.N_ASSETS] = manager.n_assets
+
+    params = np.zeros((kernel.PARAMS_SIZE,) + shape)
+    params[kernel.P_PERSON_AGE] = manager.person_age
+    params[kernel.P_SALARY] = salary
+    params[kernel.P_INFLATION_RATE] = manager.ia.inflation_rate
+    params[kernel.P_BASE_SPENDING : kernel.P_INVEST_GIVE + 1] = income_coeffs
+    params[kernel.P_GIVING_DRAW_DOWN_RATE] = draw_down_rate
+    params[kernel.P_RETIREMENT_GROWTH_RATE] = manager.retirement_investment.growth_rate
+    params[kernel.P_GIVING_GROWTH_RATE] = manager.giving_investment.growth_rate
+    params[kernel.P_ASSET_SAVINGS_GROWTH_RATE] = manager.asset_savings.growth_rate
+    params[kernel.P_RETIREMENT_AGE] = manager.retirement_age
+    params[kernel.P_RETIREMENT_DRAW_DOWN_RATE] = manager.retirement_draw_down_rate
+    params[kernel.P_STANDARD_DEDUCTION] = TaxCalculator.standard_deduction
+    params[kernel.P_CAPITAL_GAINS] = TaxCalculator.capital_gains
+    params[kernel.P_ASSET_PRICE] = manager.asset_price
+    params[kernel.P_ASSET_GROWTH_RATE] = manager.asset_growth_rate
+    params[kernel.P_ASSET_PROFIT_DIVIDEND_RATE] = Asset.profit_rate(
+        manager.asset_dividend_rate
+    )
+    return np.ascontiguousarray(state.T), np.ascontiguousarray(params.T)
 
 
 class SpendingStrategy:
@@ -252,14 +794,18 @@ class SpendingStrategy:
         self.disp_spend = disp_spend
         self.disp_give = disp_give
         self.disp_invest = 1 - disp_spend - disp_give
+        # disposible spending splits as fractions of the whole paycheck
+        self._c_spend = self.disposible_spending * self.disp_spend
+        self._c_invest = self.disposible_spending * self.disp_invest
+        self._c_give = self.disposible_spending * self.disp_give
 
     def base_retirement_spend_invest_give(self, paycheck):
         return (
             paycheck * self.base_spending,
             paycheck * self.retirement_saving,
-            paycheck * self.disposible_spending * self.disp_spend,
-            paycheck * self.disposible_spending * self.disp_invest,
-            paycheck * self.disposible_spending * self.disp_give,
+            paycheck * self._c_spend,
+            paycheck * self._c_invest,
+            paycheck * self._c_give,
         )
 
 
@@ -279,9 +825,31 @@ class GenerosityStrategy:
         return paycheck * self.straight_percent, paycheck * self.investment_percent
 
 
+def _income_coefficients(spendstrat, genstrat):
+    # fractions of a paycheck for base spending, retirement saving, disposible
+    # spending, disposible investing, straight giving and invested giving
+    return np.array(
+        [
+            spendstrat.base_spending,
+            spendstrat.retirement_saving,
+            spendstrat._c_spend,
+            spendstrat._c_invest,
+            spendstrat._c_give * genstrat.straight_percent,
+            spendstrat._c_give * genstrat.investment_percent,
+        ]
+    )
+
+
 class InflationAdjuster:
+    max_years = 120
+
     def __init__(self, inflation_rate):
         self.inflation_rate = inflation_rate
+        # factors for every month of the simulation, used by the compiled kernel
+        # (in plain python the ** below is cheaper than indexing into these)
+        months = np.arange(12 * self.max_years + 1)
+        self.reverse_factors = (1 - inflation_rate) ** (months / 12)
+        self.forward_factors = (1 + inflation_rate) ** (months / 12)
 
     def reverse_adjust(self, amount, years):
         return amount * (1 - self.inflation_rate) ** years
@@ -300,54 +868,63 @@ class TaxCalculator:
         (693751, 9999999): 0.37,
     }
     capital_gains = 0.15
+    standard_deduction = 29200
 
     def __init__(self):
-        self.year_to_date = {}
-        self.projected_inflation_adjusted_income = {}
+        # indexed by month (1-12), index 0 is unused
+        self.year_to_date = np.zeros(13)
+        self.projected_inflation_adjusted_income = np.zeros(13)
 
     def reset_year(self):
-        self.year_to_date = {}
-        self.projected_inflation_adjusted_income = {}
+        self.year_to_date.fill(0.0)
+        self.projected_inflation_adjusted_income.fill(0.0)
 
     def add_inflation_adjusted_income(self, ia_income: float, current_month: int):
         self.year_to_date[current_month] = ia_income
-        sum_income = sum(self.year_to_date.values())
+        sum_income = self.year_to_date[1 : current_month + 1].sum()
         self.projected_inflation_adjusted_income[current_month] = (
-            sum_income / (current_month / 12) - 29200  # standard deduction
+            sum_income / (current_month / 12) - self.standard_deduction
         )
 
     def get_tax_rate(self, current_month):
-        tax = 0
-        for (lower, upper), rate in self.tax_brackets.items():
-            if (
-                lower
-                <= self.projected_inflation_adjusted_income[current_month]
-                <= upper
-            ):
-                return rate
-        raise ValueError(f"Invalid income: {self.projected_inflation_adjusted_income}")
-
-    def get_tax_return(self, total_taxes_paid: float):
-        tax_rate = self.get_tax_rate(current_month=12)
+        return _bracket_rate(self.projected_inflation_adjusted_income[current_month])
+
+    def get_tax_return(self, total_taxes_paid: float, tax_rate: float):
+        # tax_rate is the rate for the full year, i.e. get_tax_rate(12)
         total_taxes = self.projected_inflation_adjusted_income[12] * tax_rate
         return total_taxes_paid - total_taxes
 
 
+# ascending bracket upper bounds and their rates, incomes outside of the brackets
+# are clamped to the lowest / highest bracket
+_UPPERS = np.array([upper for lower, upper in TaxCalculator.tax_brackets])
+_RATES = np.array(list(TaxCalculator.tax_brackets.values()))
+
+
+def _bracket_rate(income):
+    # works on a single income or an array of incomes
+    return _RATES[np.minimum(np.searchsorted(_UPPERS, income), _RATES.size - 1)]
+
+
 class SpendingTracker:
-    def __init__(self):
-        self.df = pd.DataFrame({"Spending": [], "Total": [], "years_from_start": []})
+    def __init__(self, track_history=True):
+        self._track = track_history
+        self._rows = []
         self.total = 0
 
     def add(self, amount, years_from_start):
         self.total += amount
-        new_row = pd.DataFrame(
-            {
-                "Spending": [amount],
-                "Total": [self.total],
-                "years_from_start": [years_from_start],
-            }
+        if self._track:
+            self._rows.append((amount, self.total, years_from_start))
+
+    def to_frame(self):
+        return pd.DataFrame(
+            self._rows, columns=["Spending", "Total", "years_from_start"]
         )
-        self.df = pd.concat([self.df, new_row], ignore_index=True)
+
+    @property
+    def df(self):
+        return self.to_frame()
 
 
 class Salary:
@@ -375,31 +952,38 @@ class Asset:
         growth_rate,
         years_from_start,
         dividend_rate=None,
+        track_history=True,
     ):
+        self._track = track_history
         self.name = name
         self.value = value
         self.growth_rate = growth_rate  # annual growth rate
         self.dividend_rate = dividend_rate
+        self.profit_dividend_rate = self.profit_rate(dividend_rate)
+        self._rows = [(value, years_from_start)]
+        self.last_growth = years_from_start  # purchase counts as the latest change
+
+    @classmethod
+    def profit_rate(cls, dividend_rate):
         # now subtract out expenses to estimate actual profitability
-        self.profit_dividend_rate = (1 - self.vacancy_rate) * dividend_rate - (
-            self.insurance + self.taxes + self.maintenance
+        return (1 - cls.vacancy_rate) * dividend_rate - (
+            cls.insurance + cls.taxes + cls.maintenance
         ) / 12  # (these last 3 are annualized)
-        self.df = pd.DataFrame(
-            {"Value": [value], "years_from_start": [years_from_start]}
-        )
 
     def grow(self, years_from_start):
-        most_recent_growth = self.df["years_from_start"].max()
-        if years_from_start >= (most_recent_growth + 1):
+        if years_from_start >= (self.last_growth + 1):
             new_value = round(self.value * (1 + self.growth_rate), 2)
-            new_row = pd.DataFrame(
-                {
-                    "Value": [new_value],
-                    "years_from_start": [years_from_start],
-                }
-            )
-            self.df = pd.concat([self.df, new_row], ignore_index=True)
+            if self._track:
+                self._rows.append((new_value, years_from_start))
             self.value = new_value
+            self.last_growth = years_from_start
+
+    def to_frame(self):
+        return pd.DataFrame(self._rows, columns=["Value", "years_from_start"])
+
+    @property
+    def df(self):
+        return self.to_frame()
 
     def pay_dividend(self):
         if self.dividend_rate is None:
@@ -408,20 +992,24 @@ class Asset:
 
 
 class Investment:
-    def __init__(self, name, annual_growth_rate, tax_free=False):
+    # history is stored as one preallocated array per column (grown as needed),
+    # change types are stored as their index in this list
+    change_types = ["add", "grow", "withdraw"]
+    _initial_capacity = 64
+
+    def __init__(self, name, annual_growth_rate, tax_free=False, track_history=True):
         self.name = name
         self.growth_rate = 1 + (annual_growth_rate / 12)  # monthly growth rate
         self.tax_free = tax_free
         self.total = 0
-        self.df = pd.DataFrame(
-            {
-                "Number Stocks": [],
-                "Stock Cost": [],
-                "Total Value": [],
-                "years_from_start": [],
-                "change_type": [],
-            }
-        )
+        self._track = track_history
+        self._nstocks = np.empty(self._initial_capacity)
+        self._stock_cost = np.empty(self._initial_capacity)
+        self._total = np.empty(self._initial_capacity)
+        self._years = np.empty(self._initial_capacity)
+        self._change_type = np.empty(self._initial_capacity, dtype=np.int8)
+        self._n = 0
+        self._last_grow_year = -np.inf
         self.cost_basis = None
         self.stock_cost = 1  # init at $1 / stock
         self.nstocks = 0
@@ -431,16 +1019,7 @@ class Investment:
         self._update_cost_basis(stocks_purchased)
         self.nstocks += stocks_purchased
         self.total = self.nstocks * self.stock_cost
-        new_row = pd.DataFrame(
-            {
-                "Number Stocks": [self.nstocks],
-                "Stock Cost": [self.stock_cost],
-                "Total Value": [self.total],
-                "years_from_start": [years_from_start],
-                "change_type": ["add"],
-            }
-        )
-        self.df = pd.concat([self.df, new_row], ignore_index=True)
+        self._push(years_from_start, 0)  # add
 
     def _update_cost_basis(self, stocks_purchased):
         if self.cost_basis is None:
@@ -452,23 +1031,11 @@ class Investment:
 
     def grow(self, years_from_start):
         # first verify we haven't already grown this month
-        grow_df = self.df[self.df["change_type"] == "grow"]
-        if (
-            grow_df["years_from_start"].max() < years_from_start
-            or grow_df.shape[0] == 0
-        ):
+        if self._last_grow_year < years_from_start:
             self.stock_cost *= self.growth_rate
             self.total = self.nstocks * self.stock_cost
-            new_row = pd.DataFrame(
-                {
-                    "Number Stocks": [self.nstocks],
-                    "Stock Cost": [self.stock_cost],
-                    "Total Value": [self.total],
-                    "years_from_start": [years_from_start],
-                    "change_type": ["grow"],
-                }
-            )
-            self.df = pd.concat([self.df, new_row], ignore_index=True)
+            self._push(years_from_start, 1)  # grow
+            self._last_grow_year = years_from_start
 
     def withdraw_accounting_for_taxes(self, amount, years_from_start, gains_rate=0.15):
         # did math on ipad and solved for n_stocks to withdraw post-tax amount
@@ -483,21 +1050,57 @@ class Investment:
         )
         self.nstocks -= stocks_to_sell
         self.total = self.nstocks * self.stock_cost
-        new_row = pd.DataFrame(
-            {
-                "Number Stocks": [self.nstocks],
-                "Stock Cost": [self.stock_cost],
-                "Total Value": [self.total],
-                "years_from_start": [years_from_start],
-                "change_type": ["withdraw"],
-            }
-        )
-        self.df = pd.concat([self.df, new_row], ignore_index=True)
+        self._push(years_from_start, 2)  # withdraw
         if self.tax_free:
             return 0
         else:
             return stocks_to_sell * (self.stock_cost - self.cost_basis)
 
+    def restore(self, nstocks, stock_cost, cost_basis, years_from_start):
+        # sets the state computed elsewhere (the compiled kernel), without history
+        self.nstocks = nstocks
+        self.stock_cost = stock_cost
+        self.cost_basis = cost_basis
+        self.total = nstocks * stock_cost
+        self._last_grow_year = years_from_start
+
+    def _push(self, years_from_start, change_type):
+        if not self._track:
+            return
+        if self._n == self._nstocks.size:
+            self._grow_buffers()
+        n = self._n
+        self._nstocks[n] = self.nstocks
+        self._stock_cost[n] = self.stock_cost
+        self._total[n] = self.total
+        self._years[n] = years_from_start
+        self._change_type[n] = change_type
+        self._n += 1
+
+    def _grow_buffers(self):
+        capacity = 2 * self._nstocks.size
+        for attr in ["_nstocks", "_stock_cost", "_total", "_years", "_change_type"]:
+            old = getattr(self, attr)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: old.size] = old
+            setattr(self, attr, new)
+
+    def to_frame(self):
+        n = self._n
+        return pd.DataFrame(
+            {
+                "Number Stocks": self._nstocks[:n],
+                "Stock Cost": self._stock_cost[:n],
+                "Total Value": self._total[:n],
+                "years_from_start": self._years[:n],
+                "change_type": np.array(self.change_types)[self._change_type[:n]],
+            }
+        )
+
+    @property
+    def df(self):
+        return self.to_frame()
+
     def test_sufficient_funds(self, amount, gains_rate=0.15):
         if self.tax_free:
             tax_rate = 0
@@ -510,3 +1113,64 @@ class Investment:
             return amount <= self.nstocks * (
                 (1 - tax_rate) * self.stock_cost + tax_rate * self.cost_basis
             )
+
+
+class BatchInvestment:
+    # Investment for many scenarios at once, without the per-change history.
+    # a nan cost basis means no stocks were ever bought (cost_basis None)
+    def __init__(
+        self, name, annual_growth_rate, n_scenarios, tax_free=False, dtype=np.float64
+    ):
+        self.name = name
+        self.growth_rate = 1 + (annual_growth_rate / 12)  # monthly growth rate
+        self.tax_free = tax_free
+        self.total = np.zeros(n_scenarios, dtype=dtype)
+        self.cost_basis = np.full(n_scenarios, np.nan, dtype=dtype)
+        self.stock_cost = np.ones(n_scenarios, dtype=dtype)  # init at $1 / stock
+        self.nstocks = np.zeros(n_scenarios, dtype=dtype)
+
+    def add(self, amount, where=True):
+        stocks_purchased = amount / self.stock_cost
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cost_basis = (
+                self.cost_basis * self.nstocks + self.stock_cost * stocks_purchased
+            ) / (self.nstocks + stocks_purchased)
+        cost_basis = np.where(np.isnan(self.cost_basis), self.stock_cost, cost_basis)
+        self.cost_basis = np.where(where, cost_basis, self.cost_basis)
+        self.nstocks = np.where(where, self.nstocks + stocks_purchased, self.nstocks)
+        self.total = self.nstocks * self.stock_cost
+
+    def grow(self):
+        self.stock_cost *= self.growth_rate
+        self.total = self.nstocks * self.stock_cost
+
+    def withdraw_accounting_for_taxes(self, amount, gains_rate=0.15):
+        # see Investment.withdraw_accounting_for_taxes
+        tax_rate = 0 if self.tax_free else gains_rate
+        # nothing bought yet means there are no gains to tax
+        cost_basis = np.where(
+            np.isnan(self.cost_basis), self.stock_cost, self.cost_basis
+        )
+        stocks_to_sell = amount / (
+            (1 - tax_rate) * self.stock_cost + tax_rate * cost_basis
+        )
+        self.nstocks -= stocks_to_sell
+        self.total = self.nstocks * self.stock_cost
+        if self.tax_free:
+            return np.zeros_like(amount)
+        else:
+            return stocks_to_sell * (self.stock_cost - cost_basis)
+
+    def restore(self, nstocks, stock_cost, cost_basis):
+        # sets the state computed elsewhere (the GPU kernel)
+        self.nstocks = nstocks
+        self.stock_cost = stock_cost
+        self.cost_basis = cost_basis
+        self.total = nstocks * stock_cost
+
+    def test_sufficient_funds(self, amount, gains_rate=0.15):
+        tax_rate = 0 if self.tax_free else gains_rate
+        # comparisons with a nan cost basis are False, same as Investment
+        return amount <= self.nstocks * (
+            (1 - tax_rate) * self.stock_cost + tax_rate * self.cost_basis
+        )
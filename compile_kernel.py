@@ -0,0 +1,33 @@
+# Ahead-of-time compiles kernel.simulate_year into the gen_kernel extension module,
+# so PortfolioManager.simulate_year doesn't pay numba's JIT compile on every new
+# process. Rebuild after changing kernel.py:
+#
+#   python compile_kernel.py
+#
+# classes.py falls back to the JIT kernel when gen_kernel isn't built or was built
+# from a different kernel.py.
+from numba.pycc import CC
+
+import kernel
+
+cc = CC("gen_kernel")
+cc.verbose = True
+
+KERNEL_HASH = kernel.source_hash()
+
+
+@cc.export("kernel_hash", "i8()")
+def kernel_hash():
+    return KERNEL_HASH
+
+
+# state, params, assets, ytd, tax uppers, tax rates, reverse / forward
+# inflation factors, year -> assets (see kernel.py for the layouts)
+cc.export(
+    "simulate_year",
+    "f8[:, ::1](f8[::1], f8[::1], f8[:, ::1], f8[:, ::1],"
+    " f8[::1], f8[::1], f8[::1], f8[::1], i8)",
+)(kernel.simulate_year.py_func)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -0,0 +1,143 @@
+import types
+
+import numpy as np
+from numba import cuda
+
+import kernel
+from kernel import P_SALARY, YTD_GIVING, YTD_ROWS
+
+# GPU version of kernel.py for BatchPortfolioManager: one thread simulates one
+# scenario for all of the requested years. Each scenario gets the same rows of
+# state, params, assets and ytd as kernel.py, stacked along a leading scenario
+# axis. Assets can't be reallocated on the device, so every scenario has a fixed
+# number of asset slots and overflowing them is reported back to the host.
+
+
+def _device(func, **helpers):
+    # compiles a kernel.py function for the device, helpers replaces the
+    # functions it calls with their device versions
+    py_func = getattr(func, "py_func", func)
+    if helpers:
+        py_func = types.FunctionType(
+            py_func.__code__, {**py_func.__globals__, **helpers}, py_func.__name__
+        )
+    return cuda.jit(device=True)(py_func)
+
+
+@cuda.jit(device=True)
+def _tax_rate(tax_uppers, tax_rates, income):
+    # np.searchsorted isn't available on the device, there are only a few brackets
+    for i in range(tax_uppers.size - 1):
+        if income <= tax_uppers[i]:
+            return tax_rates[i]
+    return tax_rates[tax_rates.size - 1]
+
+
+_total = _device(kernel._total)
+_add = _device(kernel._add)
+_withdraw = _device(kernel._withdraw)
+_sufficient_funds = _device(kernel._sufficient_funds)
+_inflation_factor = _device(kernel._inflation_factor)
+_ytd_sum = _device(kernel._ytd_sum)
+_simulate_month = _device(
+    kernel._simulate_month,
+    _total=_total,
+    _add=_add,
+    _withdraw=_withdraw,
+    _sufficient_funds=_sufficient_funds,
+    _tax_rate=_tax_rate,
+    _inflation_factor=_inflation_factor,
+    _ytd_sum=_ytd_sum,
+)
+
+
+@cuda.jit
+def _simulate_years(
+    state,
+    params,
+    assets,
+    ytd,
+    giving_to_date,
+    overflow,
+    tax_uppers,
+    tax_rates,
+    reverse_factors,
+    forward_factors,
+    start_year,
+    n_years,
+    salary_raise,
+):
+    idx = cuda.grid(1)
+    if idx >= state.shape[0]:
+        return
+    scenario_ytd = ytd[idx]
+    for year in range(start_year, start_year + n_years):
+        for row in range(YTD_ROWS):
+            for month in range(13):
+                scenario_ytd[row, month] = 0.0
+        for current_month in range(1, 13):
+            years_from_start = (12 * year + current_month) / 12
+            if not _simulate_month(
+                state[idx],
+                params[idx],
+                assets[idx],
+                scenario_ytd,
+                tax_uppers,
+                tax_rates,
+                reverse_factors,
+                forward_factors,
+                years_from_start,
+                current_month,
+            ):
+                overflow[idx] = 1
+                return
+        # close out year
+        giving_to_date[idx] += _ytd_sum(scenario_ytd, YTD_GIVING, 12)
+        params[idx, P_SALARY] *= salary_raise
+
+
+def simulate_years(
+    state,
+    params,
+    assets,
+    giving_to_date,
+    tax_uppers,
+    tax_rates,
+    reverse_factors,
+    forward_factors,
+    start_year,
+    n_years,
+    salary_raise,
+    threads_per_block=256,
+):
+    # state, params, assets and giving_to_date are updated in place, everything
+    # stays on the device until all the years are done
+    n_scenarios = state.shape[0]
+    d_state = cuda.to_device(state)
+    d_params = cuda.to_device(params)
+    d_assets = cuda.to_device(assets)
+    d_giving_to_date = cuda.to_device(giving_to_date)
+    d_ytd = cuda.device_array((n_scenarios, YTD_ROWS, 13))
+    d_overflow = cuda.to_device(np.zeros(n_scenarios, dtype=np.int8))
+    blocks = (n_scenarios + threads_per_block - 1) // threads_per_block
+    _simulate_years[blocks, threads_per_block](
+        d_state,
+        d_params,
+        d_assets,
+        d_ytd,
+        d_giving_to_date,
+        d_overflow,
+        cuda.to_device(tax_uppers),
+        cuda.to_device(tax_rates),
+        cuda.to_device(reverse_factors),
+        cuda.to_device(forward_factors),
+        start_year,
+        n_years,
+        salary_raise,
+    )
+    if d_overflow.copy_to_host().any():
+        raise ValueError("Ran out of asset slots, simulate with a larger max_assets")
+    d_state.copy_to_host(state)
+    d_params.copy_to_host(params)
+    d_assets.copy_to_host(assets)
+    d_giving_to_date.copy_to_host(giving_to_date)
@@ -0,0 +1,289 @@
+import hashlib
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the kernel still runs as plain python
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# ---------------- state vector layout ----------------
+# each investment takes 3 slots: number of stocks, stock cost, cost basis
+# a negative cost basis means "not set yet" (Investment.cost_basis is None)
+RETIREMENT = 0
+GIVING = 3
+ASSET_SAVINGS = 6
+N_ASSETS = 9
+STATE_SIZE = 10
+
+# ---------------- params vector layout ----------------
+P_PERSON_AGE = 0
+P_SALARY = 1
+P_INFLATION_RATE = 2
+# P_BASE_SPENDING - P_INVEST_GIVE: income coefficients, fractions of the paycheck
+P_BASE_SPENDING = 3
+P_RETIREMENT_SAVING = 4
+P_DISP_SPEND = 5
+P_DISP_INVEST = 6
+P_SPEND_GIVE = 7
+P_INVEST_GIVE = 8
+P_GIVING_DRAW_DOWN_RATE = 9  # monthly
+P_RETIREMENT_GROWTH_RATE = 10  # monthly multiplier
+P_GIVING_GROWTH_RATE = 11
+P_ASSET_SAVINGS_GROWTH_RATE = 12
+P_RETIREMENT_AGE = 13
+P_RETIREMENT_DRAW_DOWN_RATE = 14  # annual
+P_STANDARD_DEDUCTION = 15
+P_CAPITAL_GAINS = 16
+P_ASSET_PRICE = 17  # in start-of-simulation dollars
+P_ASSET_GROWTH_RATE = 18  # for newly purchased assets
+P_ASSET_PROFIT_DIVIDEND_RATE = 19
+PARAMS_SIZE = 20
+
+# ---------------- assets layout (rows x assets) ----------------
+ASSET_VALUE = 0
+ASSET_PROFIT_RATE = 1  # monthly, after expenses
+ASSET_GROWTH_RATE = 2  # annual
+ASSET_LAST_GROWTH = 3  # years from start
+ASSET_ROWS = 4
+
+# ---------------- year to date layout (rows x 13 months, index 0 unused) ----------------
+YTD_INCOME = 0
+YTD_PROJECTED_INCOME = 1
+YTD_TAXES = 2
+YTD_GIVING = 3
+YTD_ROWS = 4
+
+
+def source_hash():
+    # identifies this version of kernel.py (and so its layouts), compile_kernel.py
+    # builds it into gen_kernel so classes.py can detect a stale build
+    with open(__file__, "rb") as f:
+        return int.from_bytes(hashlib.sha256(f.read()).digest()[:7], "little")
+
+
+@njit(cache=True)
+def _total(state, inv):
+    return state[inv] * state[inv + 1]
+
+
+@njit(cache=True)
+def _add(state, inv, amount):
+    stocks_purchased = amount / state[inv + 1]
+    if state[inv + 2] < 0:
+        state[inv + 2] = state[inv + 1]
+    else:
+        state[inv + 2] = (
+            state[inv + 2] * state[inv] + state[inv + 1] * stocks_purchased
+        ) / (state[inv] + stocks_purchased)
+    state[inv] += stocks_purchased
+
+
+@njit(cache=True)
+def _withdraw(state, inv, amount, tax_rate):
+    state[inv] -= amount / ((1 - tax_rate) * state[inv + 1] + tax_rate * state[inv + 2])
+
+
+@njit(cache=True)
+def _sufficient_funds(state, inv, amount, tax_rate):
+    if state[inv + 2] < 0:
+        return False
+    return amount <= state[inv] * (
+        (1 - tax_rate) * state[inv + 1] + tax_rate * state[inv + 2]
+    )
+
+
+@njit(cache=True)
+def _tax_rate(tax_uppers, tax_rates, income):
+    return tax_rates[min(np.searchsorted(tax_uppers, income), tax_rates.size - 1)]
+
+
+@njit(cache=True)
+def _inflation_factor(factors, rate, years_from_start):
+    # factors[i] = rate ** (i / 12), see InflationAdjuster
+    index = int(round(years_from_start * 12))
+    if index < factors.size:
+        return factors[index]
+    return rate**years_from_start
+
+
+@njit(cache=True)
+def _ytd_sum(ytd, row, current_month):
+    total = 0.0
+    for month in range(1, current_month + 1):
+        total += ytd[row, month]
+    return total
+
+
+@njit(cache=True)
+def _simulate_month(
+    state,
+    params,
+    assets,
+    ytd,
+    tax_uppers,
+    tax_rates,
+    reverse_factors,
+    forward_factors,
+    years_from_start,
+    current_month,
+):
+    # the month itself, shared with gpu_kernel.py. assets can't be reallocated
+    # here, returns False (with assets unchanged) when the purchases don't fit
+    inflation_rate = params[P_INFLATION_RATE]
+    gains_rate = params[P_CAPITAL_GAINS]
+    n_assets = int(state[N_ASSETS])
+
+    # -----------get paid-----------
+    salary_paycheck = 0.0
+    retirement_income = 0.0
+    if params[P_PERSON_AGE] + years_from_start >= params[P_RETIREMENT_AGE]:
+        retirement_income = _total(state, RETIREMENT) * (
+            params[P_RETIREMENT_DRAW_DOWN_RATE] / 12
+        )
+        _withdraw(state, RETIREMENT, retirement_income, 0.0)  # tax free
+    else:
+        salary_paycheck = round(params[P_SALARY] / 12, 2)
+    assets_income = 0.0
+    for i in range(n_assets):
+        assets_income += round(assets[ASSET_PROFIT_RATE, i] * assets[ASSET_VALUE, i], 2)
+
+    total_income = salary_paycheck + assets_income + retirement_income
+    n_years = int(years_from_start)
+    ia_income = round(
+        total_income * _inflation_factor(reverse_factors, 1 - inflation_rate, n_years),
+        2,
+    )
+
+    ytd[YTD_INCOME, current_month] = ia_income
+    projected_income = (
+        _ytd_sum(ytd, YTD_INCOME, current_month) / (current_month / 12)
+        - params[P_STANDARD_DEDUCTION]
+    )
+    ytd[YTD_PROJECTED_INCOME, current_month] = projected_income
+    tax_rate = _tax_rate(tax_uppers, tax_rates, projected_income)
+    ytd[YTD_TAXES, current_month] = ia_income * tax_rate
+
+    if current_month == 12:
+        tax_return = _ytd_sum(ytd, YTD_TAXES, 12) - projected_income * tax_rate
+        total_income += tax_return
+        ytd[YTD_TAXES, 12] -= tax_return
+
+    income = total_income * (1 - tax_rate)
+
+    # -----------manage income-----------
+    retirement_saving = income * params[P_RETIREMENT_SAVING]
+    disp_invest = income * params[P_DISP_INVEST]
+    spend_give = income * params[P_SPEND_GIVE]
+    invest_give = income * params[P_INVEST_GIVE]
+    withdrawal = _total(state, GIVING) * params[P_GIVING_DRAW_DOWN_RATE]
+    _withdraw(state, GIVING, withdrawal, gains_rate)
+    _add(state, GIVING, invest_give)
+    reverse_adjustment = _inflation_factor(
+        reverse_factors, 1 - inflation_rate, years_from_start
+    )
+    ytd[YTD_GIVING, current_month] = (
+        spend_give * reverse_adjustment + withdrawal * reverse_adjustment
+    )
+
+    _add(state, RETIREMENT, retirement_saving)
+
+    n_new_assets = 0
+    asset_price = params[P_ASSET_PRICE] * _inflation_factor(
+        forward_factors, 1 + inflation_rate, years_from_start
+    )
+    if disp_invest >= asset_price:
+        n_new_assets = int(disp_invest / asset_price)
+        disp_invest -= n_new_assets * asset_price
+    if _sufficient_funds(state, ASSET_SAVINGS, asset_price - disp_invest, gains_rate):
+        n_new_assets += 1
+
+    if n_new_assets == 0:
+        _add(state, ASSET_SAVINGS, disp_invest)
+    else:
+        if n_assets + n_new_assets > assets.shape[1]:
+            return False
+        asset_price = round(asset_price, 2)
+        disp_invest = round(disp_invest, 2)
+        for i in range(n_new_assets):
+            assets[ASSET_VALUE, n_assets] = asset_price
+            assets[ASSET_PROFIT_RATE, n_assets] = params[P_ASSET_PROFIT_DIVIDEND_RATE]
+            assets[ASSET_GROWTH_RATE, n_assets] = params[P_ASSET_GROWTH_RATE]
+            assets[ASSET_LAST_GROWTH, n_assets] = years_from_start
+            n_assets += 1
+            if disp_invest >= asset_price:
+                disp_invest -= asset_price
+            else:
+                # take the remainder from the asset savings
+                _withdraw(
+                    state,
+                    ASSET_SAVINGS,
+                    round(asset_price - disp_invest, 2),
+                    gains_rate,
+                )
+        state[N_ASSETS] = n_assets
+
+    # -----------grow investments and assets-----------
+    state[RETIREMENT + 1] *= params[P_RETIREMENT_GROWTH_RATE]
+    state[GIVING + 1] *= params[P_GIVING_GROWTH_RATE]
+    state[ASSET_SAVINGS + 1] *= params[P_ASSET_SAVINGS_GROWTH_RATE]
+    if current_month == 12:
+        for i in range(n_assets):
+            if years_from_start >= assets[ASSET_LAST_GROWTH, i] + 1:
+                assets[ASSET_VALUE, i] = round(
+                    assets[ASSET_VALUE, i] * (1 + assets[ASSET_GROWTH_RATE, i]), 2
+                )
+                assets[ASSET_LAST_GROWTH, i] = years_from_start
+
+    return True
+
+
+@njit(cache=True)
+def simulate_year(
+    state,
+    params,
+    assets,
+    ytd,
+    tax_uppers,
+    tax_rates,
+    reverse_factors,
+    forward_factors,
+    year,
+):
+    # year is the number of whole years already simulated, months are 1-12.
+    # Returns assets, reallocated when the purchases didn't fit. The year is then
+    # rerun from a copy of the state, which is rare as the capacity doubles
+    saved_state = state.copy()
+    saved_ytd = ytd.copy()
+    current_month = 1
+    while current_month <= 12:
+        years_from_start = (12 * year + current_month) / 12
+        if _simulate_month(
+            state,
+            params,
+            assets,
+            ytd,
+            tax_uppers,
+            tax_rates,
+            reverse_factors,
+            forward_factors,
+            years_from_start,
+            current_month,
+        ):
+            current_month += 1
+        else:
+            # the assets owned at the start of the year are only changed in
+            # month 12, after the purchases
+            state[:] = saved_state
+            ytd[:] = saved_ytd
+            n_assets = int(state[N_ASSETS])
+            new_assets = np.empty((ASSET_ROWS, max(2 * assets.shape[1], 4)))
+            new_assets[:, :n_assets] = assets[:, :n_assets]
+            assets = new_assets
+            current_month = 1
+    return assets
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from classes import BatchPortfolioManager, GenerosityStrategy, SpendingStrategy
+
+spendstrat_params = [
+    "base_spending",
+    "retirement_saving",
+    "disp_spend",
+    "disp_give",
+]
+genstrat_params = [
+    "straight_percent",
+    "investment_draw_down_rate",
+    "legacy_give_percent",
+]
+
+
+def sample_params(param_ranges, n, seed=None):
+    # param_ranges maps a parameter to its (low, high) range or to a fixed value.
+    # Halton points cover the ranges much more evenly than uniform random draws,
+    # so fewer scenarios are needed to find the best strategies
+    varied = [name for name, value in param_ranges.items() if np.ndim(value) == 1]
+    samples = pd.DataFrame(index=range(n))
+    if varied:
+        sampler = qmc.Halton(d=len(varied), scramble=True, seed=seed)
+        lows, highs = zip(*[param_ranges[name] for name in varied])
+        samples[varied] = qmc.scale(sampler.random(n), lows, highs)
+    for name, value in param_ranges.items():
+        if name not in varied:
+            samples[name] = value
+    return samples[list(param_ranges)]
+
+
+def run_scenarios(
+    params,
+    person_age,
+    years,
+    retirement_savings=0,
+    giving_savings=0,
+    dtype=np.float32,
+):
+    # params has one row per scenario with the SpendingStrategy and
+    # GenerosityStrategy arguments plus a salary column. The scenarios are only
+    # compared to each other, so by default their state is kept in float32
+    if years < 1:
+        raise ValueError("years has to be at least 1")
+    spendstrats = [
+        SpendingStrategy(*row)
+        for row in params[spendstrat_params].itertuples(index=False)
+    ]
+    genstrats = [
+        GenerosityStrategy(*row)
+        for row in params[genstrat_params].itertuples(index=False)
+    ]
+    pm = BatchPortfolioManager(
+        person_age=person_age,
+        spendstrats=spendstrats,
+        genstrats=genstrats,
+        salaries=params["salary"].to_numpy(),
+        track_history=False,
+        dtype=dtype,
+    )
+    pm.init_retirement_savings(retirement_savings)
+    pm.init_giving_savings(giving_savings)
+
+    for i in range(12 * years):
+        pm.simulate_month((i + 1) / 12)
+
+    return params.assign(total_giving=pm.total_giving(years))